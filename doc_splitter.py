@@ -1,169 +1,536 @@
-import logging
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_BREAK
+import hashlib
+import io
 import os
-from docx.oxml import OxmlElement
+import pickle
+import posixpath
+import re
+import threading
+import traceback
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from docx.oxml.ns import qn
-from copy import deepcopy
 from lxml import etree
 
-def split_document(input_file_path, output_directory='split_documents', log_function=None):
-    def update_status(message, type="info"):
-        """Display log message in the UI and console"""
-        print(f"[{type.upper()}] {message}")  # Always print to console
-        if log_function:
-            log_function(message, type)
+# WordprocessingML namespace, for find/findall paths with the w: prefix
+_W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_W_NSMAP = {'w': _W_NS}
+
+# Qualified tag and attribute names, resolved once instead of per element
+_W_BODY = qn('w:body')
+_W_P = qn('w:p')
+_W_TBL = qn('w:tbl')
+_W_BR = qn('w:br')
+_W_TYPE = qn('w:type')
+_W_SECTPR = qn('w:sectPr')
+_W_PAGE_BREAK_BEFORE = qn('w:pageBreakBefore')
+_W_VAL = qn('w:val')
+
+# Section types that start the next section on a new page; nextPage is the
+# default when a section break has no <w:type>
+_NEW_PAGE_SECTION_TYPES = (None, 'nextPage', 'oddPage', 'evenPage')
+
+# Values switching off an on/off property such as <w:pageBreakBefore w:val="0"/>
+_OFF_VALUES = ('0', 'false', 'off')
+
+# Text of all <w:t> runs and all rows below an element, for student name
+# lookup. Compiled once; plain strings instead of lxml's smart strings.
+_TEXT_NODES = etree.XPath('.//w:t/text()', namespaces=_W_NSMAP, smart_strings=False)
+_TABLE_ROWS = etree.XPath('.//w:tr', namespaces=_W_NSMAP)
+
+# Paragraph separating the overview from the student's page
+_PAGE_BREAK_XML = f'<w:p xmlns:w="{_W_NS}"><w:r><w:br w:type="page"/></w:r></w:p>'.encode()
+
+# Placeholder for the body content when serializing the document wrapper
+_BODY_MARKER = 'docsplit-body'
+
+# The main document part of a .docx package is found through the package
+# relationships; all other parts are copied unchanged. The usual name serves
+# for packages without them.
+_PACKAGE_RELS_PART = '_rels/.rels'
+_RELATIONSHIP = '{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'
+_OFFICE_DOCUMENT_TYPES = (
+    'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument',
+    'http://purl.oclc.org/ooxml/officeDocument/relationships/officeDocument',  # Strict OOXML
+)
+_DEFAULT_DOCUMENT_PART = 'word/document.xml'
+
+# Below this many students the process pool startup costs more than it saves,
+# even when callers ask for it
+_PARALLEL_MIN_STUDENTS = 8
+
+# Serialized documents allowed to wait for their write, per worker
+_PENDING_WRITES_PER_WORKER = 2
+
+# Most progress reports split_document makes over a run; each report may be
+# a UI round trip
+_PROGRESS_UPDATES = 20
+
+# Characters dropped from student names to get file names; \w is exactly
+# str.isalnum() plus the underscore, so accented names are kept
+_UNSAFE_FILE_NAME_CHARS = re.compile(r'[^\w \-]')
+
+# Bump when the analysis result layout changes, to ignore stale cache files
+_CACHE_VERSION = 6
+
+# Analyses of recently split files kept in memory, keyed by absolute path,
+# modification time and size so that a changed file is analyzed again.
+# Each entry holds the zipped template, media included, plus the XML of every
+# page, so this can hold several times the size of the last eight inputs for
+# the life of the process. split_document(remember_analysis=False) bypasses
+# it and clear_recent_analyses() empties it.
+_RECENT_ANALYSES_MAX = 8
+_recent_analyses = OrderedDict()
+_recent_analyses_lock = threading.Lock()
+
+# Package template and main document part name shared by all tasks of a
+# worker process, set by _init_worker
+_worker_template = None
+_worker_document_part = None
+
+def _find_document_part(source_zip):
+    """Return the zip entry name of the package's main document part"""
+    try:
+        relationships = etree.fromstring(source_zip.read(_PACKAGE_RELS_PART))
+    except KeyError:
+        return _DEFAULT_DOCUMENT_PART
+    for relationship in relationships.iter(_RELATIONSHIP):
+        if (relationship.get('Type') in _OFFICE_DOCUMENT_TYPES
+                and relationship.get('TargetMode') != 'External'):
+            # Targets are relative to the package root, or absolute
+            return posixpath.normpath(posixpath.join('/', relationship.get('Target'))).lstrip('/')
+    return _DEFAULT_DOCUMENT_PART
+
+def _build_template(source_zip, document_part):
+    """Zip all source parts except the main document, compressing them once
     
-    def extract_student_name(elements):
-        """Extract student name from the first table in the elements"""
-        for element in elements:
-            if element.tag.endswith('tbl'):  # Found a table
-                # Get all text elements in the table
-                all_texts = element.findall('.//w:t', {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'})
-                
-                # First try to find "Student:" label
-                for i, text_elem in enumerate(all_texts):
-                    text = text_elem.text if text_elem.text else ""
-                    if text.strip().lower() == "student:" or text.strip().lower() == "student":
-                        # Get the next text element(s) which should contain the name
-                        name_parts = []
-                        j = i + 1
-                        while j < len(all_texts) and not all_texts[j].text.strip().lower().startswith(("company", "course", "date")):
-                            name_parts.append(all_texts[j].text.strip())
-                            j += 1
-                        if name_parts:
-                            return " ".join(name_parts).strip()
-                
-                # If not found, try to find in combined cell text
-                for row in element.findall('.//w:tr', {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}):
-                    row_text = ""
-                    for text_elem in row.findall('.//w:t', {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}):
-                        if text_elem.text:
-                            row_text += text_elem.text
-                    
-                    row_text = row_text.strip()
-                    if "Student:" in row_text or "Student" in row_text:
-                        # Extract name after "Student:" or "Student"
-                        name = row_text.split(':', 1)[1].strip() if ':' in row_text else row_text.replace('Student', '').strip()
-                        if name:
-                            return name
-        
-        return None
+    Each part keeps its entry from the source, including its compression
+    method, at the default level; this runs once per analysis, so a faster
+    level would only make every output bigger.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as package:
+        for info in source_zip.infolist():
+            if info.filename != document_part:
+                package.writestr(info, source_zip.read(info))
+    return buffer.getvalue()
+
+def _save_package(output_path, template, document_part, document_xml):
+    """Write a .docx made of the template with the given main document part
     
-    try:
-        # Verify input file exists
-        if not os.path.exists(input_file_path):
-            error_msg = f"Input file not found: {input_file_path}"
-            update_status(error_msg, "error")
-            raise FileNotFoundError(error_msg)
-        
-        update_status(f"Found input file: {input_file_path}")
-        update_status(f"File size: {os.path.getsize(input_file_path)/1024:.2f} KB")
-        
-        # Create output directory
-        if not os.path.exists(output_directory):
-            os.makedirs(output_directory)
-            update_status(f"Created output directory: {output_directory}")
+    Returns the package bytes instead when output_path is None.
+    """
+    # Appending keeps the already compressed template entries byte for byte
+    buffer = io.BytesIO(template)
+    with zipfile.ZipFile(buffer, 'a') as package:
+        # Compressed once per student, hence the fastest deflate level; the
+        # XML still shrinks to a fraction of its size
+        package.writestr(document_part, document_xml, compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+    if output_path is None:
+        return buffer.getvalue()
+    with open(output_path, 'wb') as f:
+        f.write(buffer.getbuffer())
+    return None
+
+def _init_worker(template, document_part):
+    """Receive the package template once per worker instead of once per task"""
+    global _worker_template, _worker_document_part
+    _worker_template = template
+    _worker_document_part = document_part
+
+def _save_student(output_path, document_xml):
+    """Save one student document inside a worker process"""
+    return _save_package(output_path, _worker_template, _worker_document_part, document_xml)
+
+def _extract_student_name(elements):
+    """Extract student name from the first table in the elements"""
+    for element in elements:
+        if element.tag == _W_TBL:  # Found a table
+            # Get all text in the table, collected by libxml2 in document order
+            all_texts = [text.strip() for text in _TEXT_NODES(element)]
+            
+            # First try to find "Student:" label
+            for i, text in enumerate(all_texts):
+                if text.lower() == "student:" or text.lower() == "student":
+                    # Get the next text element(s) which should contain the name
+                    name_parts = []
+                    for part in all_texts[i + 1:]:
+                        if part.lower().startswith(("company", "course", "date")):
+                            break
+                        name_parts.append(part)
+                    if name_parts:
+                        return " ".join(name_parts).strip()
+            
+            # If not found, try to find in combined cell text
+            for row in _TABLE_ROWS(element):
+                row_text = "".join(_TEXT_NODES(row)).strip()
+                if "Student:" in row_text or "Student" in row_text:
+                    # Extract name after "Student:" or "Student"
+                    name = row_text.split(':', 1)[1].strip() if ':' in row_text else row_text.replace('Student', '').strip()
+                    if name:
+                        return name
+    
+    return None
+
+def _body_child_of(element):
+    """Return the top-level body element that contains element"""
+    parent = element.getparent()
+    while parent is not None and parent.tag != _W_BODY:
+        element, parent = parent, parent.getparent()
+    return element
+
+def _iter_pages(elements, page_break_paragraphs, break_before_paragraphs, section_break_paragraphs):
+    """Yield the body elements page by page, dropping the page breaks"""
+    current_page = []
+    for element in elements:
+        if element.tag == _W_SECTPR:
+            continue
         
-        # Load the input document
-        update_status("Loading document...")
-        source_doc = Document(input_file_path)
+        # A paragraph holding a hard page break ends the page and is dropped
+        if element in page_break_paragraphs:
+            yield current_page
+            current_page = []
+            continue
         
-        # Initialize variables for page collection
-        all_pages = []
-        current_page = []
+        # These paragraphs carry content and are kept; they only start a
+        # new page if the current one has anything on it
+        if element in break_before_paragraphs and current_page:
+            yield current_page
+            current_page = []
+        current_page.append(element)
+        if element in section_break_paragraphs:
+            yield current_page
+            current_page = []
+    
+    # Add last page if it has content
+    if current_page:
+        yield current_page
+
+def _analyze_document(input_file_path):
+    """Cut the source document into the byte pieces the student outputs are made of
+    
+    Returns (template, document_part, document_head, document_tail,
+    overview_xml, pages, page_break_count): the zipped shared parts, the name
+    of the main document part, its bytes around the body content, the serialized overview, a (student_name, page_xml)
+    pair per student page, the name being None when none was found and the
+    page XML starting with a page break unless the page opens on a new page
+    by itself, and the number of top-level paragraphs with a page
+    or section break. overview_xml is None for a document without content.
+    Only plain bytes and strings are returned, so the result can be cached.
+    """
+    # Load the input package once; the main document part is replaced per
+    # student, so all other parts are zipped once into a shared template
+    with zipfile.ZipFile(input_file_path) as source_zip:
+        document_part = _find_document_part(source_zip)
+        template = _build_template(source_zip, document_part)
         
-        update_status("Analyzing document structure...")
+        # Stream the main document part through the parser and pick up
+        # page breaks as they are parsed, instead of searching afterwards.
+        # Only <w:br>, <w:pageBreakBefore> and <w:sectPr> end events reach
+        # Python; the tree is kept for copying. Pages only end at top-level
+        # paragraphs, breaks inside tables are ignored as before.
+        page_break_paragraphs = set()  # <w:br w:type="page"/>
+        break_before_paragraphs = set()  # <w:pageBreakBefore/>
+        section_break_paragraphs = set()  # section break starting a new page
+        with source_zip.open(document_part) as document_stream:
+            parser = etree.iterparse(document_stream, events=('end',),
+                                     tag=(_W_BR, _W_PAGE_BREAK_BEFORE, _W_SECTPR))
+            for _, element in parser:
+                paragraph = _body_child_of(element)
+                if paragraph.tag != _W_P:
+                    continue
+                if element.tag == _W_BR:
+                    if element.get(_W_TYPE) == 'page':
+                        page_break_paragraphs.add(paragraph)
+                elif element.getparent().getparent() is not paragraph:
+                    continue  # Properties of tracked changes, not in effect
+                elif element.tag == _W_PAGE_BREAK_BEFORE:
+                    if element.get(_W_VAL) not in _OFF_VALUES:
+                        break_before_paragraphs.add(paragraph)
+                else:
+                    section_type = element.find(_W_TYPE)
+                    if section_type is None or section_type.get(_W_VAL) in _NEW_PAGE_SECTION_TYPES:
+                        section_break_paragraphs.add(paragraph)
+            document_root = parser.root
+    body = document_root.find(_W_BODY)
+    # A paragraph can carry several kinds of break; it is counted once
+    page_break_count = len(page_break_paragraphs | break_before_paragraphs | section_break_paragraphs)
+    
+    # The body is emptied below, hence the pages are cut from a snapshot of
+    # its children
+    pages = _iter_pages(list(body), page_break_paragraphs, break_before_paragraphs,
+                        section_break_paragraphs)
+    overview_content = next(pages, None)
+    if overview_content is None:
+        return template, document_part, None, None, None, [], page_break_count
+    
+    # Serialize overview (first page) once, it is the same for every student
+    overview_xml = b''.join(etree.tostring(element, encoding='UTF-8') for element in overview_content)
+    
+    # A student page gets a page break after the overview, unless either
+    # side already forces the new page: a page starting with pageBreakBefore
+    # or an overview ending in a new-page section break. Adding one anyway
+    # would leave a blank page in between.
+    overview_ends_page = overview_content[-1] in section_break_paragraphs
+    
+    # Serialize every student page straight from the source tree, nothing
+    # is copied into a new tree. Serialized pages are emptied, so the parsed
+    # tree shrinks while the page bytes grow rather than both peaking
+    # together.
+    student_pages = []
+    for page_elements in pages:
+        page_xml = b''.join(etree.tostring(element, encoding='UTF-8') for element in page_elements)
+        if not (overview_ends_page or (page_elements and page_elements[0] in break_before_paragraphs)):
+            page_xml = _PAGE_BREAK_XML + page_xml
+        student_pages.append((_extract_student_name(page_elements), page_xml))
+        for element in page_elements:
+            element.clear()
+    
+    # Every output document.xml is the same wrapper around the body content:
+    # serialize the document with a marker in place of the content once and
+    # split it into the bytes before and after. Section properties (page
+    # setup) stay in the wrapper.
+    sect_pr = body.find(_W_SECTPR)
+    body.clear()
+    body.append(etree.Comment(_BODY_MARKER))
+    if sect_pr is not None:
+        body.append(sect_pr)
+    document_head, document_tail = etree.tostring(
+        document_root, xml_declaration=True, encoding='UTF-8', standalone=True
+    ).split(b'<!--' + _BODY_MARKER.encode() + b'-->')
+    
+    return (template, document_part, document_head, document_tail, overview_xml, student_pages,
+            page_break_count)
+
+def _analysis_cache_path(cache_dir, input_file_path, stat):
+    """Cache file for the input's analysis, changing whenever the input does"""
+    key = f"{_CACHE_VERSION}|{os.path.abspath(input_file_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    return os.path.join(cache_dir, hashlib.blake2b(key.encode()).hexdigest() + '.pkl')
+
+def _read_cached_analysis(cache_path):
+    """Return the cached analysis, or None if there is no usable one"""
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        # Missing, truncated or foreign files can fail in many ways; any of
+        # them only means the document is analyzed again
+        return None
+
+def _write_cached_analysis(cache_path, analysis):
+    """Store the analysis; written aside and renamed so readers never see half a file"""
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        with open(temp_path, 'wb') as f:
+            pickle.dump(analysis, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+def _recall_analysis(key):
+    """Return the remembered analysis for the key, or None"""
+    with _recent_analyses_lock:
+        analysis = _recent_analyses.get(key)
+        if analysis is not None:
+            _recent_analyses.move_to_end(key)
+        return analysis
+
+def _remember_analysis(key, analysis):
+    """Keep the analysis in memory, dropping the least recently used beyond the limit"""
+    with _recent_analyses_lock:
+        _recent_analyses[key] = analysis
+        _recent_analyses.move_to_end(key)
+        while len(_recent_analyses) > _RECENT_ANALYSES_MAX:
+            _recent_analyses.popitem(last=False)
+
+def clear_recent_analyses():
+    """Forget all analyses kept in memory by earlier split_document calls"""
+    with _recent_analyses_lock:
+        _recent_analyses.clear()
+
+def split_document(input_file_path, output_directory='split_documents', log_function=None, cache_dir=None,
+                   max_workers=None, sink=None, verbose=False, progress_function=None, processes=False,
+                   remember_analysis=True):
+    """Split the document into one file per student page, each prefixed by the overview page
+    
+    input_file_path may also be a seekable binary file object, e.g. a BytesIO
+    of an upload, which spares writing it to disk first. With a sink, nothing
+    is written to output_directory; instead every student document is passed
+    on as sink(file_name, data), e.g. the writestr method of an open ZipFile.
+    
+    The analysis of an input file is reused by later runs on the unchanged
+    file within this process, and with cache_dir set also across processes;
+    file objects are always analyzed. The cache files are pickles, and
+    loading a pickle can run arbitrary code, so cache_dir must be a
+    directory only trusted users can write to. remember_analysis=False
+    neither uses nor fills the in-memory copy, which holds the zipped
+    package and page XML; see also clear_recent_analyses().
+    
+    Student files are written by a thread pool of max_workers threads,
+    defaulting to the CPU count. processes=True uses a process pool instead
+    for larger documents written to output_directory; it can pay off for
+    many students on several cores, but forks the calling process, so it is
+    off by default. Sink runs always use threads, as processes would have
+    to send every finished package back through a pipe.
+    
+    Only errors and warnings are printed to the console unless verbose is
+    set, which also reports every student found and saved.
+    progress_function, if given, is called as progress_function(saved, total)
+    at most twenty times while the student documents are saved.
+    """
+    def update_status(message, type="info", detail=False):
+        """Display log message in the UI and console"""
+        if detail and not verbose:
+            return
+        if verbose or type in ('error', 'warning'):
+            print(f"[{type.upper()}] {message}")
+        if log_function:
+            log_function(message, type)
+    
+    try:
+        from_path = isinstance(input_file_path, (str, os.PathLike))
+        if from_path:
+            # One stat serves the size report and the cache key; a missing
+            # input file raises FileNotFoundError right here
+            stat = os.stat(input_file_path)
+            update_status(f"Found input file: {input_file_path}")
+            file_size = stat.st_size
+        else:
+            file_size = input_file_path.seek(0, os.SEEK_END)
+            input_file_path.seek(0)
+        update_status(f"File size: {file_size/1024:.2f} KB")
         
-        # Collect all elements while preserving their exact structure
-        for element in source_doc._element.body:
-            if element.tag.endswith('sectPr'):
-                continue
-                
-            # Check for page breaks
-            has_page_break = False
-            if element.tag.endswith('p'):
-                for child in element.iter():
-                    if child.tag.endswith('br') and child.get(qn('w:type')) == 'page':
-                        has_page_break = True
-                        break
-            
-            # Add element to current page
-            current_page.append(element)
-            
-            # If page break found, start new page
-            if has_page_break:
-                if current_page:
-                    current_page.pop()  # Remove page break
-                all_pages.append(list(current_page))
-                current_page = []
-                update_status(f"Page break detected - Page {len(all_pages)}")
+        # Create output directory; no separate existence check, which would
+        # also race with concurrent runs
+        if sink is None:
+            os.makedirs(output_directory, exist_ok=True)
         
-        # Add last page if it has content
-        if current_page:
-            all_pages.append(current_page)
+        analysis = None
+        if from_path:
+            recent_key = (os.path.abspath(input_file_path), stat.st_mtime_ns, stat.st_size)
+            if remember_analysis:
+                analysis = _recall_analysis(recent_key)
+            if analysis is None and cache_dir:
+                cache_path = _analysis_cache_path(cache_dir, input_file_path, stat)
+                analysis = _read_cached_analysis(cache_path)
+        if analysis is None:
+            update_status("Loading document...")
+            update_status("Analyzing document structure...")
+            analysis = _analyze_document(input_file_path)
+            if from_path and cache_dir:
+                # The analysis succeeded; failing to cache it is no reason
+                # to fail the split
+                try:
+                    _write_cached_analysis(cache_path, analysis)
+                except OSError as e:
+                    update_status(f"Could not cache the document analysis ({e})", "warning")
+        else:
+            update_status("Reusing cached analysis of unchanged document")
+        if from_path and remember_analysis:
+            _remember_analysis(recent_key, analysis)
+        template, document_part, document_head, document_tail, overview_xml, pages, page_break_count = analysis
         
-        update_status(f"Document split into {len(all_pages)} pages")
+        # Logged once after the scan rather than per break
+        update_status(f"Detected {page_break_count} page breaks")
         
-        if not all_pages:
+        if overview_xml is None:
             update_status("No content found in document", "error")
             raise ValueError("Document appears to be empty")
         
+        update_status(f"Document split into {len(pages) + 1} pages")
+        
         # Create individual student documents
         student_count = 0
-        overview_content = all_pages[0]  # Store overview for reuse
         
-        for idx, page_elements in enumerate(all_pages[1:], 1):
-            # Extract student name from the page
-            student_name = extract_student_name(page_elements)
-            if not student_name:
-                update_status(f"Warning: Could not find student name on page {idx}, using default name", "warning")
-                student_name = f"Unknown_Student_{idx}"
-            else:
-                update_status(f"Found student: {student_name}")
-            
-            # Create new document from original to preserve styles
-            student_doc = Document(input_file_path)
-            student_doc._element.body.clear_content()
-            
-            # Copy overview (first page)
-            for element in overview_content:
-                new_element = deepcopy(element)
-                student_doc._element.body.append(new_element)
-            
-            # Add page break
-            p = OxmlElement('w:p')
-            r = OxmlElement('w:r')
-            br = OxmlElement('w:br')
-            br.set(qn('w:type'), 'page')
-            r.append(br)
-            p.append(r)
-            student_doc._element.body.append(p)
-            
-            # Add student content
-            for element in page_elements:
-                new_element = deepcopy(element)
-                student_doc._element.body.append(new_element)
-            
-            # Save student document with their name
+        # Compressing and writing the packages is independent per student, so
+        # each one is handed off as soon as it is built and overlaps with
+        # building the next. Threads run in parallel since zlib and file
+        # writes release the GIL; a process pool is only used when asked for
+        # and worth its startup.
+        max_workers = max_workers or os.cpu_count() or 1
+        use_processes = (processes and sink is None and max_workers > 1
+                         and len(pages) >= _PARALLEL_MIN_STUDENTS)
+        if use_processes:
+            try:
+                executor = ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                               initargs=(template, document_part))
+            except (NotImplementedError, OSError) as e:
+                # Platforms without working multiprocessing primitives
+                update_status(f"Process pool unavailable ({e}), writing with threads", "warning")
+                use_processes = False
+        if not use_processes:
+            executor = ThreadPoolExecutor(max_workers)
+        max_pending = _PENDING_WRITES_PER_WORKER * max_workers
+        pending_writes = deque()
+        used_file_names = set()
+        # Rounded up, so there are at most _PROGRESS_UPDATES reports
+        progress_step = max(1, -(-len(pages) // _PROGRESS_UPDATES))
+        
+        def finish_write():
+            """Wait for the oldest pending write and report it"""
+            nonlocal student_count
+            student_name, file_name, future = pending_writes.popleft()
+            data = future.result()
+            if sink is not None:
+                sink(file_name, data)
             student_count += 1
-            safe_name = "".join(c for c in student_name if c.isalnum() or c in (' ', '_', '-')).strip()
-            output_path = os.path.join(output_directory, f'{safe_name}.docx')
-            student_doc.save(output_path)
-            update_status(f"Saved document for: {student_name}", type="success")
+            update_status(f"Saved document for: {student_name}", type="success", detail=True)
+            if progress_function and (student_count % progress_step == 0 or student_count == len(pages)):
+                progress_function(student_count, len(pages))
+        
+        with executor:
+            for idx, (student_name, student_xml) in enumerate(pages, 1):
+                if not student_name:
+                    update_status(f"Warning: Could not find student name on page {idx}, using default name", "warning")
+                    student_name = f"Unknown_Student_{idx}"
+                else:
+                    update_status(f"Found student: {student_name}", detail=True)
+                
+                # Add student content
+                document_xml = b''.join((document_head, overview_xml, student_xml, document_tail))
+                
+                # Save student document with their name; students sharing a
+                # name get numbered instead of overwriting each other
+                safe_name = _UNSAFE_FILE_NAME_CHARS.sub('', student_name).strip()
+                file_name = f'{safe_name}.docx'
+                duplicate = 1
+                while file_name.lower() in used_file_names:
+                    duplicate += 1
+                    file_name = f'{safe_name} ({duplicate}).docx'
+                used_file_names.add(file_name.lower())
+                
+                output_path = None if sink is not None else os.path.join(output_directory, file_name)
+                if use_processes:
+                    future = executor.submit(_save_student, output_path, document_xml)
+                else:
+                    future = executor.submit(_save_package, output_path, template, document_part, document_xml)
+                pending_writes.append((student_name, file_name, future))
+                
+                # Bound how many serialized documents are held in memory
+                if len(pending_writes) > max_pending:
+                    finish_write()
+            
+            while pending_writes:
+                finish_write()
         
         if student_count == 0:
             update_status("No student documents were created. Check if document has page breaks.", "warning")
         else:
             update_status(f"Created {student_count} student documents", "success")
-            created_files = os.listdir(output_directory)
-            update_status(f"Files in output directory: {', '.join(created_files)}")
+        if verbose and student_count and sink is None:
+            # One directory read per run; debug output only
+            with os.scandir(output_directory) as entries:
+                file_count = sum(1 for _ in entries)
+            update_status(f"{file_count} files in output directory: {output_directory}", detail=True)
         
         return student_count
         
     except Exception as e:
-        import traceback
         error_msg = f"Error processing document: {str(e)}\n{traceback.format_exc()}"
         update_status(error_msg, "error")
         raise
@@ -173,7 +540,7 @@ def test_split_document(input_path):
     """Test function to verify document splitting"""
     print(f"Testing document split for: {input_path}")
     try:
-        result = split_document(input_path, 'test_output')
+        result = split_document(input_path, 'test_output', verbose=True)
         print(f"Test completed successfully. Created {result} documents")
         return True
     except Exception as e:
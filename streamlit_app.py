@@ -1,20 +1,115 @@
-import shutil
+import io
 import streamlit as st
 from doc_splitter import split_document
-import os
-import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 
-def main():
-    st.set_page_config(
-        page_title="Document Splitter",
-        page_icon="📄",
-        layout="centered"
-    )
+# Prefix of each status log line by message type
+LOG_ICONS = {
+    "info": "ℹ️",
+    "success": "✅",
+    "warning": "⚠️",
+    "error": "❌",
+}
 
-    # Header
-    st.title("📄 Document Splitter")
-    st.markdown("Split your document into individual student files")
+# How often the page shows the progress and log messages of a running split
+PROGRESS_POLL_SECONDS = 0.1
+
+# Only the latest log lines are shown, keeping each log update small
+LOG_LINES_SHOWN = 200
+
+@st.cache_resource
+def split_executor():
+    """Thread pool the splits run on, so the script thread stays free to update the page
+    
+    Cached as a resource, so all sessions and reruns share the one pool
+    instead of each rerun starting its own threads.
+    """
+    return ThreadPoolExecutor(max_workers=2)
+
+def split_to_zip(file_bytes, compression_level, progress, logs):
+    """Split a document into an in-memory zip of student documents
+    
+    Runs on a worker thread, which must not call Streamlit; it only records
+    the percentage done in progress['percent'] and appends log lines to logs.
+    compression_level 0 stores the documents, 1-9 deflates them at that level.
+    """
+    def add_log(message, type="info"):
+        logs.append(f"{LOG_ICONS.get(type, '')} {message}")
+    
+    def update_progress(saved, total):
+        progress['percent'] = 5 + 90 * saved // total
+    
+    compression = zipfile.ZIP_DEFLATED if compression_level else zipfile.ZIP_STORED
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', compression, compresslevel=compression_level or None) as zip_file:
+        num_students = split_document(
+            io.BytesIO(file_bytes),
+            log_function=add_log,
+            sink=zip_file.writestr,
+            progress_function=update_progress
+        )
+    return zip_buffer.getvalue(), num_students
+
+# Each cached result holds a whole zip of student documents, so the cache
+# keeps only the latest few and lets them expire
+@st.cache_data(show_spinner=False, max_entries=8, ttl=3600)
+def split_uploaded_document(file_bytes, compression_level=0):
+    """Split an uploaded document into a zip of student documents
+    
+    Cached on the file contents and compression level, so reruns and
+    repeated clicks for the same upload skip the split. The progress bar and
+    status log are created in here, as a cache hit replays them. At most
+    eight results are kept, each for an hour.
+    """
+    # Create progress bar
+    progress_bar = st.progress(0)
+    status = st.status("Splitting document...", expanded=True)
+    log_slot = status.empty()
+    
+    progress = {'percent': 0}
+    logs = []
+    logs_read = 0
+    shown_logs = deque(maxlen=LOG_LINES_SHOWN)
+    
+    def show_progress():
+        """Bring the page up to date with the running split"""
+        nonlocal logs_read
+        progress_bar.progress(progress['percent'])
+        # The log is redrawn once per poll with any new lines, not once per
+        # message
+        new_logs = logs[logs_read:]
+        if new_logs:
+            logs_read += len(new_logs)
+            shown_logs.extend(new_logs)
+            log_slot.code("\n".join(shown_logs), language=None)
     
+    future = split_executor().submit(split_to_zip, file_bytes, compression_level, progress, logs)
+    # Polls at least once, so the log also shows for splits that finish
+    # before the first check
+    done = False
+    while not done:
+        done = bool(wait((future,), timeout=PROGRESS_POLL_SECONDS).done)
+        show_progress()
+    
+    try:
+        zip_data, num_students = future.result()
+    except Exception:
+        status.update(label="Splitting failed", state="error")
+        raise
+    
+    status.update(label="Document split", state="complete", expanded=False)
+    progress_bar.progress(100)
+    return zip_data, num_students
+
+@st.fragment
+def upload_and_split(compression_level):
+    """Upload, split and download section
+    
+    Runs as a fragment, so its widgets only rerun this section rather than
+    the whole page.
+    """
     # File upload
     uploaded_file = st.file_uploader(
         "Choose a Word document",
@@ -24,65 +119,72 @@ def main():
 
     if uploaded_file:
         st.markdown("### File Details")
-        st.write(f"Filename: {uploaded_file.name}")
-        st.write(f"Size: {uploaded_file.size/1024:.2f} KB")
+        # Formatted once per upload rather than on every rerun
+        file_details = st.session_state.get('file_details')
+        if file_details is None or file_details[0] != uploaded_file.file_id:
+            file_details = (
+                uploaded_file.file_id,
+                f"Filename: {uploaded_file.name}",
+                f"Size: {uploaded_file.size/1024:.2f} KB"
+            )
+            st.session_state['file_details'] = file_details
+        st.write(file_details[1])
+        st.write(file_details[2])
 
         # Process button
         if st.button("Split Document", type="primary"):
             try:            
-                # Create progress bar
-                progress_bar = st.progress(0)
-                
-                # Create temporary directory for processing
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    
-                    # Save uploaded file
-                    temp_input = os.path.join(temp_dir, uploaded_file.name)
-                    with open(temp_input, 'wb') as f:
-                        f.write(uploaded_file.getvalue())
-                    
-                    # Create output directory
-                    output_dir = os.path.join(temp_dir, 'split_files')
-                    os.makedirs(output_dir, exist_ok=True)
-                    
-                    progress_bar.progress(25)
-                    
-                    # Process document with custom logging function
-                    num_students = split_document(temp_input, output_dir)
-                    progress_bar.progress(75)
-                    
-                    # Verify files were created
-                    created_files = os.listdir(output_dir)
-                    
-                    # Create zip file
-                    zip_path = os.path.join(temp_dir, 'split_documents.zip')
-                    shutil.make_archive(
-                        os.path.join(temp_dir, 'split_documents'),
-                        'zip',
-                        output_dir
-                    )
-                    
-                    # Read zip file for download
-                    with open(zip_path, 'rb') as f:
-                        zip_data = f.read()
-                    
-                    progress_bar.progress(100)
-                    
-                    # Success message and download button
-                    if num_students > 0:
-                        st.success(f"Successfully split into {num_students} student documents!")
-                        st.download_button(
-                            label="📥 Download Split Documents",
-                            data=zip_data,
-                            file_name="split_documents.zip",
-                            mime="application/zip"
-                        )
-                    else:
-                        st.warning("No student documents were created. Please check if the document contains multiple pages.")
+                zip_data, num_students = split_uploaded_document(uploaded_file.getvalue(), compression_level)
+                st.session_state['split_file_id'] = uploaded_file.file_id
+                st.session_state['zip_data'] = zip_data
+                st.session_state['num_students'] = num_students
 
             except Exception as e:
+                st.session_state.pop('split_file_id', None)
                 st.error(f"An error occurred: {str(e)}")
-                import traceback
+
+        # Success message and download button; kept in session state so
+        # they survive reruns, e.g. from clicking download, for this upload
+        if st.session_state.get('split_file_id') == uploaded_file.file_id:
+            num_students = st.session_state['num_students']
+            if num_students > 0:
+                st.success(f"Successfully split into {num_students} student documents!")
+                # Handing over the zip only on click spares hashing and
+                # storing it on every rerun; the callable runs on another
+                # thread, so it keeps the bytes rather than session state
+                zip_data = st.session_state['zip_data']
+                st.download_button(
+                    label="📥 Download Split Documents",
+                    data=lambda: zip_data,
+                    file_name="split_documents.zip",
+                    mime="application/zip",
+                    on_click="ignore"
+                )
+            else:
+                st.warning("No student documents were created. Please check if the document contains multiple pages.")
+
+def main():
+    st.set_page_config(
+        page_title="Document Splitter",
+        page_icon="📄",
+        layout="centered"
+    )
+
+    # Header
+    st.title("📄 Document Splitter")
+    st.markdown("Split your document into individual student files")
+    
+    # The documents are already compressed, so by default the zip only
+    # stores them; deflating again mostly pays off over slow connections
+    compression_level = st.sidebar.slider(
+        "Zip compression",
+        min_value=0,
+        max_value=9,
+        value=0,
+        help="0 stores the documents as they are (fastest); 1-9 compress them further"
+    )
+    
+    upload_and_split(compression_level)
 
     # Instructions
     with st.expander("ℹ️ How to use"):